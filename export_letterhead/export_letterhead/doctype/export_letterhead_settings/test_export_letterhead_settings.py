@@ -2,7 +2,17 @@
 # See license.txt
 
 # import frappe
-from frappe.tests import IntegrationTestCase
+from frappe.tests import IntegrationTestCase, UnitTestCase
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+from export_letterhead.patches import _write_xlsx
+from export_letterhead.utils import (
+	_compile_letterhead,
+	_render_letterhead_layout,
+	_render_template,
+	_split_rendered_rows,
+)
 
 
 # On IntegrationTestCase, the doctype test records and all
@@ -11,6 +21,61 @@ from frappe.tests import IntegrationTestCase
 EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 
+LETTERHEAD_CONTEXT = {
+	"company": "Acme Corp",
+	"report_name": "General Ledger",
+	"pipe": "a|b",
+	"tab": "a\tb",
+	"empty": "",
+}
+
+
+class UnitTestExportLetterheadSettings(UnitTestCase):
+	"""
+	Unit tests for letterhead row generation.
+	Use this class for testing individual functions and methods.
+	"""
+
+	def assertLetterheadRows(self, template, expected, pre_split):
+		"""Check both render paths against expected, and which path produces the rows."""
+		full = _split_rendered_rows(_render_template(template, dict(LETTERHEAD_CONTEXT)))
+		self.assertEqual(full, expected, template)
+
+		layout = _compile_letterhead(template)
+		fast = _render_letterhead_layout(layout, dict(LETTERHEAD_CONTEXT)) if layout is not None else None
+		self.assertEqual(fast is not None, pre_split, template)
+		if fast is not None:
+			self.assertEqual(fast, expected, template)
+
+	def test_layout_matches_full_render(self):
+		cases = [
+			("{{ company }}\nExport Report", [("Acme Corp",), ("Export Report",)], True),
+			("{{ company }} | {{ report_name }}", [("Acme Corp", "General Ledger")], True),
+			("{{ company }}\t{{ report_name }} | x", [("Acme Corp", "General Ledger | x")], True),
+			("{{ company | upper }} | {{ report_name | lower }}", [("ACME CORP", "general ledger")], True),
+			("{{ company }}\r\n{{ report_name }}\r\n", [("Acme Corp",), ("General Ledger",)], True),
+			("\n{{ company }}\n\n  \n{{ empty }}\n{{ empty }} | {{ empty }}\n", [("Acme Corp",), ("", "")], True),
+			# Separators rendered by a value change the layout, so these fall back
+			("{{ '|' }} x", [("", "x")], False),
+			("{{ pipe }}", [("a", "b")], False),
+			("{{ tab }} | y", [("a", "b | y")], False),
+		]
+		for template, expected, pre_split in cases:
+			self.assertLetterheadRows(template, expected, pre_split)
+
+	def test_whitespace_control_joins_lines(self):
+		self.assertIsNone(_compile_letterhead("Company:\n{{- company }}"))
+		self.assertIsNone(_compile_letterhead("{{ company -}}\n| x"))
+		self.assertLetterheadRows("Company:\n{{- company }}", [("Company:Acme Corp",)], False)
+		self.assertLetterheadRows("{{ company -}}\n| x", [("Acme Corp", "x")], False)
+
+	def test_export_font_applies_to_written_cells(self):
+		for wb in (None, Workbook(write_only=True)):
+			xlsx_file = _write_xlsx([["x", 1], ["y"]], "Sheet1", wb, None, Font(name="Verdana", size=14))
+			ws = load_workbook(xlsx_file)["Sheet1"]
+			for cell in ("A1", "B1", "A2"):
+				self.assertEqual(ws[cell].font.name, "Verdana")
+				self.assertEqual(ws[cell].font.sz, 14)
 
 
 class IntegrationTestExportLetterheadSettings(IntegrationTestCase):
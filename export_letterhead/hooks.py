@@ -140,6 +140,12 @@ app_license = "mit"
 # 	}
 # }
 
+doc_events = {
+	"Export Letterhead Settings": {
+		"on_update": "export_letterhead.patches.clear_settings_cache",
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
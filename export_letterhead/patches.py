@@ -6,8 +6,7 @@ to all Excel and CSV exports. It intercepts export calls and prepends letterhead
 with custom templates, then applies font settings to all rows.
 
 Patched Functions:
-- make_xlsx: Excel file generation (used by query reports, report views)
-- build_xlsx_response: Excel response builder
+- make_xlsx: Excel file generation (used by query reports, report views and build_xlsx_response)
 - build_csv_response: CSV response builder
 - get_csv_bytes: CSV bytes generator (used by query reports)
 - query_report._export_query: Query report exports
@@ -17,8 +16,8 @@ How It Works:
 1. Patches are applied on module import and via boot_session hook
 2. When export functions are called, letterhead rows are generated from template
 3. Letterhead rows are prepended to export data
-4. Font settings (name and size) are applied to ALL rows in Excel exports
-5. Original functions are called with modified data
+4. Excel files are built once with font settings (name and size) on ALL rows
+5. Other original functions are called with modified data
 
 Example Flow:
     User exports report → _export_query_with_letterhead() called
@@ -26,43 +25,133 @@ Example Flow:
     → Letterhead rows generated from template
     → Data prepended with letterhead
     → make_xlsx() called with letterhead + data
-    → Font applied to all rows
+    → Workbook built with font on all rows
     → Excel file returned
 """
 
+import importlib
+from itertools import chain
+
 import frappe
-from export_letterhead.utils import _get_settings, _build_context, _generate_letterhead_rows
+
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+except ImportError:
+    # openpyxl ships with Frappe, but keep this module importable without it so
+    # boot_session and the CSV patches still work; Excel exports with letterhead
+    # enabled raise a clear error instead (see _wrap_make_xlsx)
+    Workbook = None
+
+from export_letterhead.utils import (
+    _FONT_NAME_RE,
+    _bump_settings_version,
+    _get_settings,
+    _build_context,
+    _extract_params,
+    _generate_letterhead_rows,
+    _has_letterhead_content,
+)
 from io import BytesIO
 
 
-# Store original functions before patching (for restoration if needed)
+# Set once every target in _PATCH_TARGETS has been patched
+_PATCHES_APPLIED = False
+
+# Store original functions before patching (for restoration if needed).
+# Wrappers keep their own closure reference and don't read from this dict.
 _original_functions = {}
 
+# openpyxl's default workbook font as (font_name, font_size)
+_DEFAULT_FONT = ("Calibri", 11)
 
-def _get_param_value(source, *keys, default=None):
+# Export Font objects keyed by raw (font_name, font_size) settings
+_FONT_CACHE = {}
+
+# Sentinel for "settings not fetched yet in this request" (None means fetch failed)
+_MISSING = object()
+
+# Request-local state lives on frappe.local (a werkzeug Local, which has no
+# __dict__, raises internally for missing attributes and copies its storage on
+# every assignment). Entries are reset to their "unset" value (None / _MISSING)
+# instead of being probed with hasattr and removed with delattr, and only
+# written when they actually change.
+
+
+def _get_settings_cached():
     """
-    Safely fetch parameter values from dict / frappe._dict / objects.
+    Return Export Letterhead Settings, fetched at most once per request.
+    
+    A single export usually passes through several wrappers (e.g. _export_query
+    → make_xlsx), so the settings are stored on frappe.local and dropped when
+    the request ends or the settings are saved.
     """
-    if not source:
-        return default
+    settings = getattr(frappe.local, 'export_letterhead_settings', _MISSING)
+    if settings is _MISSING:
+        settings = frappe.local.export_letterhead_settings = _get_settings()
+    return settings
 
-    for key in keys:
-        value = None
-        if isinstance(source, dict):
-            value = source.get(key)
-        else:
-            try:
-                value = getattr(source, key)
-            except AttributeError:
-                value = None
 
-        if isinstance(value, str):
-            value = value.strip()
+def _pop_export_context():
+    """
+    Return the export context set by a higher-level wrapper and clear it.
+    
+    Reads frappe.local once and only writes back when a context was set.
+    """
+    local = frappe.local
+    export_context = getattr(local, 'export_letterhead_context', None)
+    if export_context is not None:
+        local.export_letterhead_context = None
+    return export_context
+
+
+def _get_letterhead_rows(settings, context):
+    """
+    Return letterhead rows for an export, rendered at most once per request.
+    
+    Rows are memoized on frappe.local by (doctype, report_name, user), so nested
+    wrappers within the same export reuse the rendered template.
+    """
+    rows_cache = getattr(frappe.local, 'export_letterhead_rows', None)
+    if rows_cache is None:
+        rows_cache = frappe.local.export_letterhead_rows = {}
+    
+    key = (context.get("doctype"), context.get("report_name"), frappe.session.user)
+    letterhead_rows = rows_cache.get(key)
+    if letterhead_rows is None:
+        letterhead_rows = rows_cache[key] = _generate_letterhead_rows(settings, context)
+    return letterhead_rows
+
 
-        if value not in (None, ""):
-            return value
+def clear_settings_cache(doc=None, method=None):
+    """
+    doc_events hook for Export Letterhead Settings to drop cached settings
+    (in this request and, via the settings version, in every worker) and
+    request-cached letterhead rows.
+    """
+    # on_update runs before the DB commit; bumping the version now would let
+    # another worker memoize the old row under the new version
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is not None:
+        after_commit.add(_bump_settings_version)
+    else:
+        # Older Frappe versions without commit callbacks
+        _bump_settings_version()
+    frappe.local.export_letterhead_settings = _MISSING
+    frappe.local.export_letterhead_rows = None
 
-    return default
+
+def _get_param_value(source, *keys, default=None):
+    """
+    Safely fetch parameter values from dict / frappe._dict / objects.
+    
+    Returns the first non-empty value of the given keys (see _extract_params).
+    """
+    params = _extract_params(source, keys)
+    return next((value for value in params.values() if value is not None), default)
 
 
 def apply_patches():
@@ -75,127 +164,148 @@ def apply_patches():
     
     Patched Functions:
     - frappe.utils.xlsxutils.make_xlsx: Core Excel generation
-    - frappe.utils.xlsxutils.build_xlsx_response: Excel HTTP response
     - frappe.utils.csvutils.build_csv_response: CSV HTTP response
     - frappe.desk.utils.get_csv_bytes: CSV bytes for reports
     - frappe.desk.query_report._export_query: Query report exports
     - frappe.desk.reportview._export_query: Report view exports
     """
     # Only apply patches once
-    if hasattr(apply_patches, '_applied'):
+    global _PATCHES_APPLIED
+    if _PATCHES_APPLIED:
         return
-    apply_patches._applied = True
-    
-    # Patch make_xlsx
-    from frappe.utils import xlsxutils
-    if 'make_xlsx' not in _original_functions:
-        _original_functions['make_xlsx'] = xlsxutils.make_xlsx
-        xlsxutils.make_xlsx = _make_xlsx_with_letterhead
-    
-    # Patch build_xlsx_response
-    if 'build_xlsx_response' not in _original_functions:
-        _original_functions['build_xlsx_response'] = xlsxutils.build_xlsx_response
-        xlsxutils.build_xlsx_response = _build_xlsx_response_with_letterhead
-    
-    # Patch build_csv_response
-    from frappe.utils import csvutils
-    if 'build_csv_response' not in _original_functions:
-        _original_functions['build_csv_response'] = csvutils.build_csv_response
-        csvutils.build_csv_response = _build_csv_response_with_letterhead
-    
-    # Patch get_csv_bytes (used by query reports)
-    from frappe.desk import utils as desk_utils
-    if 'get_csv_bytes' not in _original_functions:
-        _original_functions['get_csv_bytes'] = desk_utils.get_csv_bytes
-        desk_utils.get_csv_bytes = _get_csv_bytes_with_letterhead
-    
-    # Patch query_report._export_query to pass better context
-    from frappe.desk import query_report
-    if '_export_query' not in _original_functions:
-        _original_functions['_export_query'] = query_report._export_query
-        query_report._export_query = _export_query_with_letterhead
-    
-    # Patch reportview._export_query to pass better context
-    from frappe.desk import reportview
-    if '_export_query_reportview' not in _original_functions:
-        _original_functions['_export_query_reportview'] = reportview._export_query
-        reportview._export_query = _export_query_with_letterhead_reportview
-
-
-def _make_xlsx_with_letterhead(data, sheet_name, wb=None, column_widths=None):
-    """
-    Wrapper for make_xlsx to add letterhead rows and apply font formatting.
-    
-    This function intercepts Excel file generation and:
-    1. Generates letterhead rows from template
-    2. Prepends letterhead rows to data
-    3. Calls original make_xlsx function
-    4. Applies font settings (name and size) to ALL rows
-    
-    Args:
-        data: List of rows (each row is a list of cell values)
-        sheet_name: Name of the Excel sheet
-        wb: Optional existing workbook
-        column_widths: Optional list of column widths
     
-    Returns:
-        BytesIO object containing Excel file with letterhead and font formatting
+    # Each target is imported and patched on its own, so one module failing to
+    # import (e.g. during installation) doesn't prevent patching the others
+    all_applied = True
+    for key, module_name, attr, wrap in _PATCH_TARGETS:
+        if key in _original_functions:
+            continue
+        
+        try:
+            module = importlib.import_module(module_name)
+            original = getattr(module, attr)
+        except (ImportError, AttributeError):
+            # Retry on the next call (e.g. from boot_session)
+            all_applied = False
+            continue
+        
+        _original_functions[key] = original
+        setattr(module, attr, wrap(original))
     
-    Example:
-        Input data: [["Header1", "Header2"], ["Value1", "Value2"]]
-        Letterhead: [["Company Name"], ["Printed by: User"]]
-        Output: Excel file with letterhead rows at top, all rows with custom font
-    """
-    settings = _get_settings()
-    letterhead_rows_count = 0
+    _PATCHES_APPLIED = all_applied
+
+
+def _wrap_make_xlsx(original):
+    """Wrap make_xlsx, keeping the original bound in the closure."""
     
-    if settings and settings.get("enabled"):
-        # Try to get context from frappe.local if set by higher-level functions
-        export_context = getattr(frappe.local, 'export_letterhead_context', None)
+    def _make_xlsx_with_letterhead(data, sheet_name, wb=None, column_widths=None):
+        """
+        Wrapper for make_xlsx to add letterhead rows and apply font formatting.
         
-        # Build context from available data
-        if export_context:
-            context = export_context.copy()
-        else:
-            context = _build_context((data, sheet_name), {"doctype": sheet_name, "report_name": sheet_name})
+        This function intercepts Excel file generation and:
+        1. Generates letterhead rows from template
+        2. Prepends letterhead rows to data
+        3. Builds the workbook with font settings (name and size) on ALL rows
+        4. Serializes the workbook once
         
-        # Generate letterhead rows (includes template rows + "Printed by" row if enabled)
-        letterhead_rows = _generate_letterhead_rows(settings, context)
+        Falls back to the original make_xlsx function when letterhead is disabled.
         
-        if letterhead_rows:
-            # Count ALL letterhead rows (template rows + "Printed by" row)
-            letterhead_rows_count = len(letterhead_rows)
-            # Prepend letterhead rows to data
-            data = list(letterhead_rows) + list(data)
+        Args:
+            data: List of rows (each row is a list of cell values)
+            sheet_name: Name of the Excel sheet
+            wb: Optional existing workbook
+            column_widths: Optional list of column widths
+        
+        Returns:
+            BytesIO object containing Excel file with letterhead and font formatting
+        
+        Example:
+            Input data: [["Header1", "Header2"], ["Value1", "Value2"]]
+            Letterhead: [["Company Name"], ["Printed by: User"]]
+            Output: Excel file with letterhead rows at top, all rows with custom font
+        """
+        settings = _get_settings_cached()
+        
+        if not (settings and settings.get("enabled")):
+            return original(data, sheet_name, wb, column_widths)
+        
+        if Workbook is None:
+            raise ImportError("openpyxl is required for Excel exports with Export Letterhead enabled")
+        
+        # Take context from frappe.local if set by higher-level functions
+        export_context = _pop_export_context()
+        
+        # Font still applies when the template is blank; only skip the letterhead
+        if _has_letterhead_content(settings):
+            # Build context from available data
+            if export_context:
+                # Already cleared from frappe.local, so this wrapper owns it
+                context = export_context
+            else:
+                context = _build_context((data, sheet_name), {"doctype": sheet_name, "report_name": sheet_name})
+            
+            # Generate letterhead rows (includes template rows + "Printed by" row if enabled)
+            letterhead_rows = _get_letterhead_rows(settings, context)
+            
+            if letterhead_rows:
+                # Prepend letterhead rows lazily; _write_xlsx only iterates the rows
+                data = chain(letterhead_rows, data)
         
-        # Clear context after use
-        if hasattr(frappe.local, 'export_letterhead_context'):
-            delattr(frappe.local, 'export_letterhead_context')
+        return _write_xlsx(data, sheet_name, wb, column_widths, _get_export_font(settings))
     
-    # Call original function
-    xlsx_file = _original_functions['make_xlsx'](data, sheet_name, wb, column_widths)
+    return _make_xlsx_with_letterhead
+
+
+def _normalize_font_settings(font_name, font_size):
+    """
+    Validate font settings into a usable (font_name, font_size) pair.
     
-    # Apply font settings to ALL rows if enabled (letterhead + data rows)
-    if settings and settings.get("enabled"):
-        xlsx_file = _apply_font_to_all_rows(xlsx_file, settings, letterhead_rows_count)
+    Args:
+        font_name: Raw font name from settings
+        font_size: Raw font size from settings
     
-    return xlsx_file
+    Returns:
+        Tuple of (font_name, font_size), e.g. ("Arial", 11)
+    """
+    # Get font settings and ensure they're the correct type
+    if font_name:
+        font_name = str(font_name).strip()
+    if not font_name:
+        font_name = "Arial"
+    
+    # Validate font name (remove any invalid characters)
+    # Excel font names are typically alphanumeric with spaces and hyphens
+    font_name = _FONT_NAME_RE.sub('', font_name).strip()
+    if not font_name:
+        font_name = "Arial"
+    
+    # Ensure font_size is an integer and within valid range
+    try:
+        font_size = int(font_size) if font_size else 11
+        # Excel font size range is typically 1-409
+        if font_size < 1:
+            font_size = 11
+        elif font_size > 409:
+            font_size = 409
+    except (ValueError, TypeError):
+        font_size = 11
+    
+    return font_name, font_size
 
 
-def _apply_font_to_all_rows(xlsx_file, settings, letterhead_rows_count):
+def _get_export_font(settings):
     """
-    Apply font settings (name and size) to ALL rows in Excel file.
+    Build the openpyxl Font for export rows from settings.
     
-    Loads the Excel file, applies configured font to every row (letterhead + data),
-    and saves it back. Font is applied at both row and cell level for consistency.
+    The normalized Font is memoized per (font_name, font_size) so repeated
+    exports reuse the same object without re-validating the settings.
     
     Args:
-        xlsx_file: BytesIO object containing Excel file
         settings: Dictionary with font_name and font_size
-        letterhead_rows_count: Number of letterhead rows (for reference, not used)
     
     Returns:
-        BytesIO object with font formatting applied
+        openpyxl Font object, or None when the settings match the workbook
+        default font (Calibri 11) and no font needs to be applied
     
     Font Settings:
         - font_name: Font family (e.g., "Arial", "Calibri", "Times New Roman")
@@ -203,183 +313,175 @@ def _apply_font_to_all_rows(xlsx_file, settings, letterhead_rows_count):
     
     Example:
         settings = {"font_name": "Calibri", "font_size": 12}
-        → All rows in Excel file will use Calibri 12pt font
+        → Font(name="Calibri", size=12)
     """
-    try:
-        from openpyxl import load_workbook
-        from openpyxl.styles import Font
-        
-        # Reset file pointer
-        xlsx_file.seek(0)
-        
-        # Load workbook (read-write mode to allow modifications)
-        wb = load_workbook(xlsx_file, read_only=False)
-        ws = wb.active
-        
-        # Get font settings and ensure they're the correct type
-        font_name = settings.get("font_name", "Arial")
-        if font_name:
-            font_name = str(font_name).strip()
-        if not font_name:
-            font_name = "Arial"
-        
-        # Validate font name (remove any invalid characters)
-        # Excel font names are typically alphanumeric with spaces and hyphens
-        import re
-        font_name = re.sub(r'[^\w\s\-]', '', font_name).strip()
-        if not font_name:
-            font_name = "Arial"
-        
-        # Ensure font_size is an integer and within valid range
-        font_size = settings.get("font_size", 11)
-        try:
-            font_size = int(font_size) if font_size else 11
-            # Excel font size range is typically 1-409
-            if font_size < 1:
-                font_size = 11
-            elif font_size > 409:
-                font_size = 409
-        except (ValueError, TypeError):
-            font_size = 11
-        
-        # Create font object once for efficiency
-        export_font = Font(name=font_name, size=font_size)
-        
-        # Get the maximum row number in the worksheet
-        max_row = ws.max_row
-        
-        # Apply font to ALL rows in the worksheet (letterhead + data)
-        # Rows are 1-indexed in openpyxl
-        for row_idx in range(1, max_row + 1):
-            try:
-                # Apply to row dimensions (affects entire row)
-                row_dim = ws.row_dimensions[row_idx]
-                row_dim.font = export_font
-                
-                # Also apply to each cell in the row to ensure it takes effect
-                # This is important because cell-level font overrides row-level font
-                for cell in ws[row_idx]:
-                    if cell:
-                        cell.font = export_font
-            except Exception as row_error:
-                # Log but continue with other rows
-                frappe.logger("letterhead").debug(
-                    f"Failed to apply font to row {row_idx}: {row_error}"
-                )
-        
-        # Save to new BytesIO
-        new_file = BytesIO()
-        wb.save(new_file)
-        new_file.seek(0)
-        wb.close()  # Close workbook to free resources
-        return new_file
-    except Exception as e:
-        frappe.logger("letterhead").error(
-            f"Failed to apply font to all rows: {e}",
-            exc_info=True
-        )
-        # Return original file if font application fails
-        try:
-            xlsx_file.seek(0)
-        except Exception:
-            pass
-        return xlsx_file
-
-
-def _build_xlsx_response_with_letterhead(data, filename):
-    """Wrapper for build_xlsx_response to add letterhead rows"""
-    settings = _get_settings()
+    key = (settings.get("font_name", "Arial"), settings.get("font_size", 11))
+    export_font = _FONT_CACHE.get(key, _MISSING)
+    if export_font is not _MISSING:
+        return export_font
     
-    if settings and settings.get("enabled"):
-        # Try to get context from frappe.local if set by higher-level functions
-        export_context = getattr(frappe.local, 'export_letterhead_context', None)
-        
-        if export_context:
-            context = export_context.copy()
-        else:
-            # Build context
-            context = _build_context((data, filename), {"doctype": filename, "report_name": filename})
-        
-        # Generate letterhead rows
-        letterhead_rows = _generate_letterhead_rows(settings, context)
-        
-        if letterhead_rows:
-            # Prepend letterhead rows to data
-            data = list(letterhead_rows) + list(data)
-        
-        # Clear context after use
-        if hasattr(frappe.local, 'export_letterhead_context'):
-            delattr(frappe.local, 'export_letterhead_context')
+    font = _normalize_font_settings(*key)
+    if font == _DEFAULT_FONT:
+        export_font = None
+    else:
+        export_font = Font(name=font[0], size=font[1])
     
-    # Call original function which uses make_xlsx
-    # The font will be applied by make_xlsx wrapper
-    return _original_functions['build_xlsx_response'](data, filename)
+    # Font objects are immutable once styled, so one instance is shared per process
+    return _FONT_CACHE.setdefault(key, export_font)
 
 
-def _build_csv_response_with_letterhead(data, filename):
+def _write_xlsx(data, sheet_name, wb, column_widths, export_font):
     """
-    Wrapper for build_csv_response to add letterhead rows.
+    Build and serialize an Excel file with the export font on every row.
     
-    Adds letterhead rows to CSV data before building HTTP response.
-    Note: CSV files don't support font formatting, only content is added.
+    Mirrors Frappe's make_xlsx (write-only workbook, column widths, HTML handling,
+    illegal character cleanup) but uses the export font as the workbook default,
+    so the file is written exactly once instead of being saved, reloaded and
+    saved again. Cells are styled individually only for caller-supplied workbooks.
     
     Args:
-        data: List of rows for CSV export
-        filename: Name for the exported file
+        data: List of rows (letterhead + data)
+        sheet_name: Name of the Excel sheet
+        wb: Optional existing workbook
+        column_widths: Optional list of column widths
+        export_font: openpyxl Font applied to all cells, or None to keep the
+            workbook default font
     
     Returns:
-        HTTP response with CSV file containing letterhead rows
+        BytesIO object containing Excel file
     """
-    settings = _get_settings()
+    # Imported here so a failing xlsxutils import can't break this whole module;
+    # make_xlsx is only patched (and this only called) once xlsxutils imported
+    from frappe.utils.xlsxutils import handle_html
+    
+    column_widths = column_widths or []
+    if wb is None:
+        # Write-only mode streams rows out instead of holding the cell grid
+        wb = Workbook(write_only=True)
+        # Make the export font the workbook default (font 0, used by the Normal
+        # style and every unstyled cell) so no per-cell font has to be written.
+        # This relies on openpyxl internals (checked with openpyxl 3.1):
+        # Workbook.__init__ seeds wb._fonts with only DEFAULT_FONT and binds the
+        # Normal style to fontId 0, and unstyled cells are written with xf 0.
+        # If wb._fonts doesn't look like that, style each cell instead. The
+        # private IndexedList class is reached through the instance rather than
+        # imported, so a moved module only disables this shortcut.
+        fonts = getattr(wb, "_fonts", None)
+        if export_font is not None and type(fonts).__name__ == "IndexedList" and len(fonts) == 1:
+            wb._fonts = type(fonts)([export_font])
+            style_cells = False
+        else:
+            style_cells = export_font is not None
+    else:
+        # A caller-supplied workbook may rely on its default font elsewhere
+        style_cells = export_font is not None
+    
+    ws = wb.create_sheet(sheet_name, 0)
+    
+    # Column widths must be set before any row is appended in write-only mode
+    for i, column_width in enumerate(column_widths):
+        if column_width:
+            ws.column_dimensions[get_column_letter(i + 1)].width = column_width
+    
+    convert_html = sheet_name not in ["Data Import Template", "Data Export"]
+    
+    for row in data:
+        clean_row = []
+        for item in row:
+            value = item
+            if isinstance(item, str):
+                if convert_html:
+                    value = handle_html(item)
+                # Remove illegal characters from the string (one scan; sub
+                # returns the same string object when nothing matches)
+                value = ILLEGAL_CHARACTERS_RE.sub("", value)
+            
+            if style_cells:
+                value = WriteOnlyCell(ws, value=value)
+                value.font = export_font
+            clean_row.append(value)
+        
+        ws.append(clean_row)
+    
+    xlsx_file = BytesIO()
+    wb.save(xlsx_file)
+    return xlsx_file
+
+
+def _wrap_build_csv_response(original):
+    """Wrap build_csv_response, keeping the original bound in the closure."""
     
-    if settings and settings.get("enabled"):
-        # Try to get context from frappe.local if set by higher-level functions
-        export_context = getattr(frappe.local, 'export_letterhead_context', None)
+    def _build_csv_response_with_letterhead(data, filename):
+        """
+        Wrapper for build_csv_response to add letterhead rows.
+        
+        Adds letterhead rows to CSV data before building HTTP response.
+        Note: CSV files don't support font formatting, only content is added.
+        
+        Args:
+            data: List of rows for CSV export
+            filename: Name for the exported file
+        
+        Returns:
+            HTTP response with CSV file containing letterhead rows
+        """
+        settings = _get_settings_cached()
+        
+        if not _has_letterhead_content(settings):
+            return original(data, filename)
+        
+        # Take context from frappe.local if set by higher-level functions
+        export_context = _pop_export_context()
         
         if export_context:
-            context = export_context.copy()
+            # Already cleared from frappe.local, so this wrapper owns it
+            context = export_context
         else:
             # Build context
             context = _build_context((data, filename), {"doctype": filename, "report_name": filename})
         
         # Generate letterhead rows
-        letterhead_rows = _generate_letterhead_rows(settings, context)
+        letterhead_rows = _get_letterhead_rows(settings, context)
         
         if letterhead_rows:
-            # Prepend letterhead rows to data
-            data = list(letterhead_rows) + list(data)
+            # Prepend letterhead rows lazily; the CSV writer consumes rows one by one
+            data = chain(letterhead_rows, data)
         
-        # Clear context after use
-        if hasattr(frappe.local, 'export_letterhead_context'):
-            delattr(frappe.local, 'export_letterhead_context')
+        # Call original function
+        return original(data, filename)
     
-    # Call original function
-    return _original_functions['build_csv_response'](data, filename)
+    return _build_csv_response_with_letterhead
 
 
-def _get_csv_bytes_with_letterhead(data, csv_params):
-    """
-    Wrapper for get_csv_bytes to add letterhead rows.
-    
-    Used by query reports for CSV export. Adds letterhead rows to data
-    before converting to CSV bytes. Context is extracted from frappe.local
-    if set by higher-level export functions.
-    
-    Args:
-        data: List of rows for CSV export
-        csv_params: Dictionary with CSV parameters (delimiter, quoting, etc.)
-    
-    Returns:
-        Bytes object containing CSV data with letterhead rows
-    """
-    settings = _get_settings()
+def _wrap_get_csv_bytes(original):
+    """Wrap get_csv_bytes, keeping the original bound in the closure."""
     
-    if settings and settings.get("enabled"):
-        # Try to get context from frappe.local if set by higher-level functions
-        export_context = getattr(frappe.local, 'export_letterhead_context', None)
+    def _get_csv_bytes_with_letterhead(data, csv_params):
+        """
+        Wrapper for get_csv_bytes to add letterhead rows.
+        
+        Used by query reports for CSV export. Adds letterhead rows to data
+        before converting to CSV bytes. Context is extracted from frappe.local
+        if set by higher-level export functions.
+        
+        Args:
+            data: List of rows for CSV export
+            csv_params: Dictionary with CSV parameters (delimiter, quoting, etc.)
+        
+        Returns:
+            Bytes object containing CSV data with letterhead rows
+        """
+        settings = _get_settings_cached()
+        
+        if not _has_letterhead_content(settings):
+            return original(data, csv_params)
+        
+        # Take context from frappe.local if set by higher-level functions
+        export_context = _pop_export_context()
         
         if export_context:
-            context = export_context.copy()
+            # Already cleared from frappe.local, so this wrapper owns it
+            context = export_context
         else:
             # Build context - try to get doctype from data if possible
             doctype = "Export"
@@ -389,121 +491,148 @@ def _get_csv_bytes_with_letterhead(data, csv_params):
             context = _build_context((data,), {"doctype": doctype, "report_name": doctype})
         
         # Generate letterhead rows
-        letterhead_rows = _generate_letterhead_rows(settings, context)
+        letterhead_rows = _get_letterhead_rows(settings, context)
         
         if letterhead_rows:
-            # Prepend letterhead rows to data
-            data = list(letterhead_rows) + list(data)
+            # Prepend letterhead rows lazily; the CSV writer consumes rows one by one
+            data = chain(letterhead_rows, data)
         
-        # Clear context after use
-        if hasattr(frappe.local, 'export_letterhead_context'):
-            delattr(frappe.local, 'export_letterhead_context')
+        # Call original function
+        return original(data, csv_params)
     
-    # Call original function
-    return _original_functions['get_csv_bytes'](data, csv_params)
+    return _get_csv_bytes_with_letterhead
 
 
-def _export_query_with_letterhead(form_params, csv_params, populate_response=True):
-    """
-    Wrapper for query_report._export_query to add letterhead context.
+def _wrap_export_query(original):
+    """Wrap query_report._export_query, keeping the original bound in the closure."""
     
-    Extracts report information and sets context in frappe.local for
-    letterhead template rendering. This ensures report name and doctype
-    are available in templates.
-    
-    Args:
-        form_params: Form parameters containing report_name, filters, etc.
-        csv_params: CSV export parameters
-        populate_response: Whether to populate HTTP response
-    
-    Returns:
-        Result from original _export_query function
-    
-    Context Variables Set:
-        - doctype: Reference doctype from report (if available)
-        - report_name: Name of the report being exported
-    
-    Example:
-        Report "Sales Invoice Report" with ref_doctype "Sales Invoice"
-        → Context: {"doctype": "Sales Invoice", "report_name": "Sales Invoice Report"}
-        → Template can use: {{ report_name }} or {{ doctype }}
-    """
-    # Set context for letterhead generation
-    try:
-        report_name = _get_param_value(form_params, "report_name", "report")
-        if not report_name:
-            report_name = _get_param_value(getattr(frappe.local, "form_dict", None), "report_name", "report")
-        if not report_name:
-            report_name = "Query Report"
-
-        # Try to get ref_doctype from report
+    def _export_query_with_letterhead(form_params, csv_params, populate_response=True):
+        """
+        Wrapper for query_report._export_query to add letterhead context.
+        
+        Extracts report information and sets context in frappe.local for
+        letterhead template rendering. This ensures report name and doctype
+        are available in templates.
+        
+        Args:
+            form_params: Form parameters containing report_name, filters, etc.
+            csv_params: CSV export parameters
+            populate_response: Whether to populate HTTP response
+        
+        Returns:
+            Result from original _export_query function
+        
+        Context Variables Set:
+            - doctype: Reference doctype from report (if available)
+            - report_name: Name of the report being exported
+        
+        Example:
+            Report "Sales Invoice Report" with ref_doctype "Sales Invoice"
+            → Context: {"doctype": "Sales Invoice", "report_name": "Sales Invoice Report"}
+            → Template can use: {{ report_name }} or {{ doctype }}
+        """
+        settings = _get_settings_cached()
+        if not _has_letterhead_content(settings):
+            return original(form_params, csv_params, populate_response)
+        
+        # Set context for letterhead generation
         try:
-            report_doc = frappe.get_doc("Report", report_name)
-            ref_doctype = getattr(report_doc, "ref_doctype", None)
+            params = _extract_params(form_params, ("report_name", "report"))
+            report_name = params["report_name"] or params["report"]
+            if not report_name:
+                report_name = _get_param_value(getattr(frappe.local, "form_dict", None), "report_name", "report")
+            if not report_name:
+                report_name = "Query Report"
+
+            # Try to get ref_doctype from report (cached, no full doc load)
+            try:
+                ref_doctype = frappe.get_cached_value("Report", report_name, "ref_doctype")
+            except Exception:
+                ref_doctype = None
+            
+            frappe.local.export_letterhead_context = _build_context(
+                (),
+                {
+                    "doctype": ref_doctype or report_name,
+                    "report_name": report_name,
+                }
+            )
         except Exception:
-            ref_doctype = None
-        
-        frappe.local.export_letterhead_context = _build_context(
-            (),
-            {
-                "doctype": ref_doctype or report_name,
-                "report_name": report_name,
-            }
-        )
-    except Exception:
-        pass
+            pass
+        
+        try:
+            # Call original function
+            return original(form_params, csv_params, populate_response)
+        finally:
+            # Clean up context (if no nested wrapper consumed it)
+            _pop_export_context()
     
-    try:
-        # Call original function
-        return _original_functions['_export_query'](form_params, csv_params, populate_response)
-    finally:
-        # Clean up context
-        if hasattr(frappe.local, 'export_letterhead_context'):
-            delattr(frappe.local, 'export_letterhead_context')
+    return _export_query_with_letterhead
 
 
-def _export_query_with_letterhead_reportview(form_params, csv_params, populate_response=True):
-    """
-    Wrapper for reportview._export_query to add letterhead context.
-    
-    Extracts doctype from form parameters and sets context for letterhead
-    template rendering. Used for report view exports (list view exports).
-    
-    Args:
-        form_params: Form parameters containing doctype, filters, fields, etc.
-        csv_params: CSV export parameters
-        populate_response: Whether to populate HTTP response
-    
-    Returns:
-        Result from original reportview._export_query function
-    
-    Context Variables Set:
-        - doctype: Document type being exported (e.g., "Sales Invoice", "Customer")
+def _wrap_export_query_reportview(original):
+    """Wrap reportview._export_query, keeping the original bound in the closure."""
     
-    Example:
-        Exporting "Sales Invoice" list view
-        → Context: {"doctype": "Sales Invoice"}
-        → Template can use: {{ doctype }}
-    """
-    # Set context for letterhead generation
-    try:
-        doctype = _get_param_value(form_params, "doctype")
-        report_label = _get_param_value(form_params, "report_name", "title", "report") or doctype
-        if doctype:
-            frappe.local.export_letterhead_context = _build_context(
-                (),
-                {"doctype": doctype, "report_name": report_label or doctype}
-            )
-    except Exception:
-        pass
-    
-    try:
-        # Call original function
-        return _original_functions['_export_query_reportview'](form_params, csv_params, populate_response)
-    finally:
-        # Clean up context
-        if hasattr(frappe.local, 'export_letterhead_context'):
-            delattr(frappe.local, 'export_letterhead_context')
+    def _export_query_with_letterhead_reportview(form_params, csv_params, populate_response=True):
+        """
+        Wrapper for reportview._export_query to add letterhead context.
+        
+        Extracts doctype from form parameters and sets context for letterhead
+        template rendering. Used for report view exports (list view exports).
+        
+        Args:
+            form_params: Form parameters containing doctype, filters, fields, etc.
+            csv_params: CSV export parameters
+            populate_response: Whether to populate HTTP response
+        
+        Returns:
+            Result from original reportview._export_query function
+        
+        Context Variables Set:
+            - doctype: Document type being exported (e.g., "Sales Invoice", "Customer")
+        
+        Example:
+            Exporting "Sales Invoice" list view
+            → Context: {"doctype": "Sales Invoice"}
+            → Template can use: {{ doctype }}
+        """
+        settings = _get_settings_cached()
+        if not _has_letterhead_content(settings):
+            return original(form_params, csv_params, populate_response)
+        
+        # Set context for letterhead generation
+        try:
+            params = _extract_params(form_params, ("doctype", "report_name", "title", "report"))
+            doctype = params["doctype"]
+            report_label = params["report_name"] or params["title"] or params["report"] or doctype
+            if doctype:
+                frappe.local.export_letterhead_context = _build_context(
+                    (),
+                    {"doctype": doctype, "report_name": report_label or doctype}
+                )
+        except Exception:
+            pass
+        
+        try:
+            # Call original function
+            return original(form_params, csv_params, populate_response)
+        finally:
+            # Clean up context (if no nested wrapper consumed it)
+            _pop_export_context()
+    
+    return _export_query_with_letterhead_reportview
+
+
+# Patch targets: (_original_functions key, module, attribute, wrapper factory)
+_PATCH_TARGETS = (
+    ('make_xlsx', 'frappe.utils.xlsxutils', 'make_xlsx', _wrap_make_xlsx),
+    ('build_csv_response', 'frappe.utils.csvutils', 'build_csv_response', _wrap_build_csv_response),
+    # get_csv_bytes is used by query reports
+    ('get_csv_bytes', 'frappe.desk.utils', 'get_csv_bytes', _wrap_get_csv_bytes),
+    # _export_query wrappers pass better context
+    ('_export_query', 'frappe.desk.query_report', '_export_query', _wrap_export_query),
+    ('_export_query_reportview', 'frappe.desk.reportview', '_export_query', _wrap_export_query_reportview),
+)
 
 
 def boot_session(bootinfo):
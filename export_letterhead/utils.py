@@ -5,7 +5,8 @@ This module provides helper functions for adding letterhead to Excel/CSV exports
 It handles settings retrieval, template rendering, and letterhead row generation.
 
 Key Functions:
-- _get_settings(): Retrieves and validates export letterhead settings
+- _get_settings(): Retrieves and validates export letterhead settings (memoized per site)
+- _has_letterhead_content(): Checks whether settings produce any letterhead rows
 - _build_context(): Builds context dictionary for template rendering with available variables
 - _render_template(): Renders Jinja2 templates with context
 - _generate_letterhead_rows(): Generates letterhead rows from template
@@ -36,40 +37,125 @@ Template Examples:
    {% endif %}
 """
 
+import datetime
+import os
+import re
+import time
+from functools import lru_cache
+
 import frappe
 from frappe.utils import now_datetime
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FunctionLoader,
+    TemplateAssertionError,
+    TemplateError,
+    UndefinedError,
+    meta,
+)
 
 
-def _safe_get_value(source, *keys):
-    """
-    Safely fetch a value from dict-like or object-like sources.
+# Shared environment for letterhead templates (templates are compiled from strings,
+# so there is nothing to auto-reload)
+_ENV = Environment(autoescape=False, auto_reload=False)
+
+# Per-site environments with an on-disk bytecode cache (opt-in via settings)
+_BYTECODE_ENVS = {}
+
+# Jinja2 expressions ({{ ... }}); separators inside them (e.g. filters) don't split cells
+_EXPRESSION_RE = re.compile(r"\{\{.*?\}\}")
+
+# Line breaks as normalized by Jinja2's lexer
+_NEWLINE_RE = re.compile(r"\r\n|\r|\n")
+
+# Characters not allowed in Excel font names
+_FONT_NAME_RE = re.compile(r'[^\w\s\-]')
+
+# Cache key bumped whenever Export Letterhead Settings are saved
+_SETTINGS_VERSION_KEY = "export_letterhead_settings_ver"
+
+# Per-site in-process settings as {site: (version, settings)}
+_SETTINGS_CACHE = {}
+
 
+def _extract_params(source, keys):
+    """
+    Fetch several parameter values from dict / frappe._dict / objects in one pass.
+    
     Handles frappe._dict instances (which return None instead of raising AttributeError)
-    and plain dicts/objects. Returns the first non-empty value found for the provided keys.
+    and plain dicts/objects. Returns a dict mapping each key to its value (strings
+    stripped), or None when the value is missing or empty.
     """
+    params = dict.fromkeys(keys)
     if not source:
-        return None
-
+        return params
+    
+    # dict and frappe._dict expose .get; fall back to attributes for plain objects
+    get = getattr(source, 'get', None)
     for key in keys:
-        value = None
-        if isinstance(source, dict):
-            value = source.get(key)
-        else:
-            try:
-                value = getattr(source, key)
-            except AttributeError:
-                value = None
-
-        if isinstance(value, str):
+        value = get(key) if get else getattr(source, key, None)
+        
+        if value.__class__ is str:
             value = value.strip()
-
+        
         if value not in (None, ""):
-            return value
+            params[key] = value
+    
+    return params
 
-    return None
+
+def _safe_get_value(source, *keys):
+    """
+    Safely fetch a value from dict-like or object-like sources.
+
+    Returns the first non-empty value found for the provided keys (see _extract_params).
+    """
+    params = _extract_params(source, keys)
+    return next((value for value in params.values() if value is not None), None)
 
 
 def _get_settings():
+    """
+    Return Export Letterhead Settings, memoized in-process per site.
+    
+    The cached value is reused until the settings version in Frappe's cache
+    changes (bumped by _bump_settings_version when the settings are saved), so
+    exports skip the Single doctype fetch entirely. See _fetch_settings for the
+    returned keys. Returns None if settings cannot be retrieved.
+    """
+    try:
+        version = frappe.cache().get_value(_SETTINGS_VERSION_KEY)
+        if version is None:
+            # The cache was flushed (e.g. bench clear-cache): seed a new version
+            # so every worker refetches instead of trusting what it memoized
+            version = _bump_settings_version()
+        site = frappe.local.site
+    except Exception:
+        return _fetch_settings()
+    
+    cached = _SETTINGS_CACHE.get(site)
+    if cached and cached[0] == version:
+        return cached[1]
+    
+    settings = _fetch_settings()
+    if settings is not None:
+        _SETTINGS_CACHE[site] = (version, settings)
+    return settings
+
+
+def _bump_settings_version():
+    """
+    Invalidate memoized settings in every worker (called when settings are saved).
+    
+    Returns the new version.
+    """
+    version = time.time()
+    frappe.cache().set_value(_SETTINGS_VERSION_KEY, version)
+    return version
+
+
+def _fetch_settings():
     """
     Retrieve and validate Export Letterhead Settings.
     
@@ -79,6 +165,8 @@ def _get_settings():
     - font_name: String - Font name to use (e.g., "Arial", "Calibri")
     - font_size: Integer - Font size (1-409)
     - add_printed_by: Boolean - Whether to add "Printed by" row
+    - enable_bytecode_cache: Boolean - Whether to cache compiled templates on disk
+      (only used for templates rendered as a whole, see _compile_letterhead)
     
     Returns None if settings cannot be retrieved.
     """
@@ -100,8 +188,7 @@ def _get_settings():
             font_name = "Arial"
         
         # Clean font name (remove invalid characters)
-        import re
-        font_name = re.sub(r'[^\w\s\-]', '', font_name).strip()
+        font_name = _FONT_NAME_RE.sub('', font_name).strip()
         if not font_name:
             font_name = "Arial"
         
@@ -111,25 +198,96 @@ def _get_settings():
             "font_name": font_name,
             "font_size": font_size,
             "add_printed_by": getattr(s, "add_printed_by", True),
+            "enable_bytecode_cache": getattr(s, "enable_bytecode_cache", False),
         }
     except Exception as e:
         frappe.logger("letterhead").debug("Failed to get export letterhead settings", exc_info=True)
         return None
 
 
+def _has_letterhead_content(settings):
+    """
+    Check whether settings would produce any letterhead rows.
+    
+    Cheap pre-check so callers can skip context building (session, user
+    defaults, Report lookups) when letterhead is disabled or has no template.
+    """
+    return bool(settings and settings.get("enabled") and settings.get("letterhead_template"))
+
+
+class _LazyContext(dict):
+    """
+    Template context that computes session/user-default variables on first access.
+    
+    Keys with a matching _compute_<key> method (user_fullname, company, now,
+    date, time) are computed when first looked up and then stored, so exports
+    whose templates don't reference them skip the corresponding Frappe calls.
+    
+    Lookups (ctx[key], ctx.get, "key in ctx") see the lazy keys, but keys(),
+    items(), copy() and **ctx only include values computed so far. Resolve
+    variables by name (see _template_values) instead of passing **ctx to Jinja2.
+    """
+    
+    LAZY_KEYS = ("user_fullname", "company", "now", "date", "time")
+    
+    def __missing__(self, key):
+        compute = getattr(self, f"_compute_{key}", None) if key in self.LAZY_KEYS else None
+        if compute is None:
+            raise KeyError(key)
+        value = self[key] = compute()
+        return value
+    
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.LAZY_KEYS
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def _compute_user_fullname(self):
+        # frappe.session is a _dict; read it once and use .get for both keys
+        sess = frappe.session
+        try:
+            return sess.get("user_fullname") or sess.get("user")
+        except Exception:
+            return None
+    
+    def _compute_company(self):
+        # Company from user defaults
+        try:
+            return frappe.defaults.get_user_default("company") or ""
+        except Exception:
+            return ""
+    
+    def _compute_now(self):
+        try:
+            return now_datetime()
+        except Exception:
+            return datetime.datetime.now()
+    
+    def _compute_date(self):
+        return self["now"].date()
+    
+    def _compute_time(self):
+        return self["now"].time()
+
+
 def _build_context(args, kwargs):
     """
     Build context dictionary for Jinja2 template rendering.
     
     Extracts available information from function arguments and Frappe session
-    to provide variables for template rendering.
+    to provide variables for template rendering. Session and user-default
+    variables are computed lazily (see _LazyContext).
     
     Args:
         args: Tuple of positional arguments (unused but kept for compatibility)
         kwargs: Dictionary of keyword arguments (may contain doctype, report_name)
     
     Returns:
-        Dictionary with template variables:
+        _LazyContext with template variables:
         - frappe: Frappe object
         - user_fullname: Current user's full name
         - doctype: Document type identifier or filename
@@ -139,14 +297,7 @@ def _build_context(args, kwargs):
         - time: Current time
         - now: Current datetime
     """
-    context = {
-        "frappe": frappe,
-    }
-    
-    try:
-        context["user_fullname"] = frappe.session.user_fullname or frappe.session.user
-    except Exception:
-        context["user_fullname"] = frappe.session.user if hasattr(frappe.session, 'user') else None
+    context = _LazyContext(frappe=frappe)
 
     if isinstance(kwargs, dict):
         if kwargs.get("doctype"):
@@ -167,39 +318,119 @@ def _build_context(args, kwargs):
     elif context.get("doctype") and not context.get("report_name"):
         context["report_name"] = context["doctype"]
     
-    # Company from user defaults
-    try:
-        context["company"] = frappe.defaults.get_user_default("company") or ""
-    except Exception:
-        context["company"] = ""
+    return context
+
+
+@lru_cache(maxsize=128)
+def _template_variables(template_text):
+    """
+    Return the context variable names a template references.
     
-    # Add common variables
+    Only these are resolved from the context at render time, so lazy context
+    values the template doesn't use are never computed. Returns None if the
+    template can't be analysed (e.g. it uses a filter only Frappe defines).
+    """
+    if "{{" not in template_text and "{%" not in template_text:
+        return frozenset()
     try:
-        from frappe.utils import now_datetime
-        now = now_datetime()
-        context["now"] = now
-        context["date"] = now.date()
-        context["time"] = now.time()
-    except Exception:
-        import datetime
-        now = datetime.datetime.now()
-        context["now"] = now
-        context["date"] = now.date()
-        context["time"] = now.time()
+        return frozenset(meta.find_undeclared_variables(_ENV.parse(template_text)))
+    except TemplateError:
+        return None
+
+
+def _template_values(context, names):
+    """Resolve the given variable names (all context variables if None) from context."""
+    if names is None:
+        names = set(context).union(getattr(context, "LAZY_KEYS", ()))
+    return {name: context[name] for name in names if name in context}
+
+
+def _load_template_source(template_text):
+    """FunctionLoader source for bytecode-cached templates (the name is the template text)."""
+    return template_text, None, lambda: True
+
+
+def _get_bytecode_env():
+    """
+    Return this site's Jinja2 environment backed by a FileSystemBytecodeCache.
     
-    return context
+    Jinja2 only consults the bytecode cache for templates loaded through a
+    loader, so templates are loaded by name via a FunctionLoader. Compiled
+    bytecode is stored in the site's jinja_cache folder and invalidated by
+    Jinja2's source checksum.
+    """
+    site = frappe.local.site
+    env = _BYTECODE_ENVS.get(site)
+    if env is None:
+        cache_dir = frappe.get_site_path("jinja_cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        env = _BYTECODE_ENVS[site] = Environment(
+            loader=FunctionLoader(_load_template_source),
+            bytecode_cache=FileSystemBytecodeCache(cache_dir),
+            autoescape=False,
+            auto_reload=False,
+        )
+    return env
 
 
-def _render_template(template_text, context):
+class _StaticTemplate:
+    """
+    Stand-in for a Jinja2 template without any Jinja2 syntax.
+    
+    Renders to the text exactly as Jinja2 would (line breaks normalized to
+    "\n", a single trailing newline dropped) without compiling anything.
+    """
+    
+    def __init__(self, text):
+        lines = _NEWLINE_RE.split(text)
+        if lines[-1] == "":
+            del lines[-1]
+        self.text = "\n".join(lines)
+    
+    def render(self, *args, **kwargs):
+        return self.text
+
+
+def _is_static(template_text):
+    """Check whether text has no Jinja2 syntax at all ({{, {% or {#)."""
+    return "{{" not in template_text and "{%" not in template_text and "{#" not in template_text
+
+
+def _compile_template(template_text, bytecode_cache=False):
+    """
+    Compile a letterhead template once per distinct template string.
+    
+    Keyed on the raw template text, so unchanged settings reuse the compiled
+    template across exports and requests. Text without {{, {% or {# is not
+    compiled at all. With bytecode_cache, the template comes from this site's
+    environment (which keeps its own compiled templates), so the first compile
+    in a fresh worker reads bytecode from the site's disk cache when available.
+    """
+    if bytecode_cache and not _is_static(template_text):
+        return _get_bytecode_env().get_template(template_text)
+    return _compile_from_string(template_text)
+
+
+@lru_cache(maxsize=128)
+def _compile_from_string(template_text):
+    """Compile a letterhead template in the shared environment, memoized by text."""
+    if _is_static(template_text):
+        return _StaticTemplate(template_text)
+    return _ENV.from_string(template_text)
+
+
+def _render_template(template_text, context, bytecode_cache=False):
     """
     Render Jinja2 template with provided context.
     
-    Uses Jinja2 for template rendering. Falls back to frappe.render_template
-    or returns original text if rendering fails.
+    Uses a cached compiled Jinja2 template. Falls back to frappe.render_template
+    for names only Frappe's Jinja environment provides, and logs the error and
+    returns the original text if rendering fails.
     
     Args:
         template_text: Jinja2 template string
         context: Dictionary of variables for template rendering
+        bytecode_cache: Whether to use the on-disk bytecode cache
     
     Returns:
         Rendered template string
@@ -209,16 +440,151 @@ def _render_template(template_text, context):
         context = {"company": "Acme Corp", "date": "2025-01-15"}
         Returns: "Acme Corp | 2025-01-15"
     """
+    # Disk-cached templates skip the variable scan: parsing the template again
+    # would undo most of what the bytecode cache saves, so every context
+    # variable is resolved instead
+    names = None if bytecode_cache else _template_variables(template_text)
+    values = _template_values(context or {}, names)
     try:
-        from jinja2 import Template
-        tpl = Template(template_text)
-        return tpl.render(**(context or {}))
+        return _compile_template(template_text, bytecode_cache).render(values)
+    except (UndefinedError, TemplateAssertionError):
+        # Undefined globals (e.g. _) or unknown filters may come from Frappe's
+        # Jinja environment, which adds its own globals and filters
+        try:
+            return frappe.render_template(template_text, values)
+        except Exception:
+            frappe.logger("letterhead").warning("Failed to render letterhead template", exc_info=True)
+    except TemplateError as e:
+        # Syntax errors fail the same way in Frappe's Jinja environment
+        frappe.logger("letterhead").warning(f"Invalid letterhead template: {e}")
     except Exception:
-        # Fallback to frappe.render_template if available
+        # Runtime error in template code (e.g. a failing frappe call)
+        frappe.logger("letterhead").error("Failed to render letterhead template", exc_info=True)
+    
+    return template_text
+
+
+def _split_outside_expressions(line, sep):
+    """
+    Split a template line on sep, ignoring separators inside {{ ... }} expressions.
+    
+    Returns None if sep only occurs inside expressions.
+    """
+    spans = [m.span() for m in _EXPRESSION_RE.finditer(line)]
+    parts = []
+    start = 0
+    pos = line.find(sep)
+    while pos != -1:
+        if not any(a <= pos < b for a, b in spans):
+            parts.append(line[start:pos])
+            start = pos + 1
+        pos = line.find(sep, pos + 1)
+    
+    if not parts:
+        return None
+    parts.append(line[start:])
+    return parts
+
+
+@lru_cache(maxsize=128)
+def _compile_letterhead(template_text):
+    """
+    Pre-split a letterhead template into rows of compiled cell templates.
+    
+    The row/column layout of a template with only {{ ... }} expressions is fixed,
+    so lines and separators are analysed once and each cell is compiled on its own.
+    
+    Returns:
+        Tuple of (separator, cells) per non-empty line, where each cell is a
+        (compiled template, variable names) pair and separator is "\t", "|"
+        or None. None if the template has block tags, comments or whitespace
+        control, which may span or join lines, so the layout is only known
+        after rendering.
+    """
+    if "{%" in template_text or "{#" in template_text:
+        return None
+    
+    # Whitespace control ({{- / -}}) can strip the line breaks between rows
+    if "{{-" in template_text or "-}}" in template_text:
+        return None
+    
+    layout = []
+    for line in template_text.split('\n'):
+        if not line.strip():
+            continue
+        
+        sep = None
+        cells = [line]
+        for candidate in ('\t', '|'):
+            parts = _split_outside_expressions(line, candidate)
+            if parts is not None:
+                sep, cells = candidate, parts
+                break
+        
         try:
-            return frappe.render_template(template_text, context)
+            layout.append((sep, tuple(
+                (_compile_template(c), _template_variables(c)) for c in cells
+            )))
         except Exception:
-            return template_text
+            # A fragment that doesn't compile on its own; render the whole template
+            return None
+    
+    return tuple(layout)
+
+
+def _render_letterhead_layout(layout, context):
+    """
+    Render a pre-split letterhead layout into rows of cells.
+    
+    Produces the same rows as splitting the fully rendered template. Returns
+    None (so the caller renders the whole template instead) if rendering fails
+    or a value renders a separator or line break, since that would change the
+    layout.
+    """
+    rows = []
+    try:
+        for sep, cells in layout:
+            rendered = tuple(t.render(_template_values(context, names)) for t, names in cells)
+            for value in rendered:
+                # A pipe only matters when tabs aren't already the separator
+                if '\n' in value or '\t' in value or (sep != '\t' and '|' in value):
+                    return None
+            
+            if sep == '|':
+                rows.append(tuple(c.strip() for c in rendered))
+            elif ''.join(rendered).strip():
+                # Lines that render blank are skipped, as in the full render
+                rows.append(rendered)
+    except Exception:
+        return None
+    
+    return rows
+
+
+def _split_rendered_rows(rendered):
+    """
+    Split a rendered letterhead template into rows of cells.
+    
+    Each non-empty line becomes a row; cells are separated by tabs or pipes.
+    """
+    rows = []
+    for line in rendered.split('\n'):
+        if line.strip():  # Skip empty lines
+            # Each row can have multiple columns separated by tabs or pipes;
+            # tabs take precedence, so the separator is decided once per line
+            sep = '\t' if '\t' in line else ('|' if '|' in line else None)
+            if sep == '|':
+                # Pipe-separated columns (strip whitespace from each cell)
+                cells = tuple(c.strip() for c in line.split('|'))
+            elif sep:
+                # Tab-separated columns
+                cells = tuple(line.split('\t'))
+            else:
+                # Single cell row (no separator found)
+                cells = (line,)
+            rows.append(cells)
+    
+    return rows
 
 
 def _generate_letterhead_rows(settings, context=None):
@@ -234,7 +600,7 @@ def _generate_letterhead_rows(settings, context=None):
         context: Optional context dictionary for template variables
     
     Returns:
-        List of rows, where each row is a list of cell values.
+        List of rows, where each row is a tuple of cell values.
         Empty list if disabled or no template.
     
     Template Format:
@@ -245,29 +611,27 @@ def _generate_letterhead_rows(settings, context=None):
     Examples:
         1. Single column rows:
            Template: "{{ company }}\nExport Report"
-           Returns: [["Acme Corp"], ["Export Report"]]
+           Returns: [("Acme Corp",), ("Export Report",)]
         
         2. Multi-column with pipe:
            Template: "{{ company }} | {{ date }}"
-           Returns: [["Acme Corp", "2025-01-15"]]
+           Returns: [("Acme Corp", "2025-01-15")]
         
         3. Multi-column with tab:
            Template: "{{ company }}\t{{ user_fullname }}"
-           Returns: [["Acme Corp", "John Doe"]]
+           Returns: [("Acme Corp", "John Doe")]
         
         4. With "Printed by" row (if enabled):
            Returns: [
-               ["Acme Corp"],
-               ["Printed by: John Doe", "Date: 2025-01-15", "Time: 14:30:00"]
+               ("Acme Corp",),
+               ("Printed by: John Doe", "Date: 2025-01-15", "Time: 14:30:00")
            ]
     """
     # Check if letterhead is enabled and template exists
-    if not settings or not settings.get("enabled") or not settings.get("letterhead_template"):
+    if not _has_letterhead_content(settings):
         return []
     
-    template_text = settings.get("letterhead_template", "")
-    if not template_text:
-        return []
+    template_text = settings["letterhead_template"]
     
     # Build context with additional info if not provided
     if context is None:
@@ -277,46 +641,33 @@ def _generate_letterhead_rows(settings, context=None):
     if not context.get("report_name") and context.get("doctype"):
         context["report_name"] = context["doctype"]
     
-    # Add common context variables (these are always available)
-    context.update({
-        "frappe": frappe,
-        "user_fullname": frappe.session.user_fullname or frappe.session.user,
-        "now": now_datetime(),
-        "date": now_datetime().date(),
-        "time": now_datetime().time(),
-        "company": frappe.defaults.get_user_default("company") or "",
-    })
+    # Common context variables are always available. Values already in the
+    # context (e.g. from _build_context) are kept; missing ones are computed
+    # lazily, only if the template or "Printed by" row uses them
+    if not isinstance(context, _LazyContext):
+        context = _LazyContext(context)
+    context.setdefault("frappe", frappe)
     
-    # Render template with context
-    rendered = _render_template(template_text, context)
+    bytecode_cache = bool(settings.get("enable_bytecode_cache"))
     
-    # Split rendered template into rows (each line becomes a row)
-    rows = []
-    for line in rendered.split('\n'):
-        if line.strip():  # Skip empty lines
-            # Each row can have multiple columns separated by tabs or pipes
-            if '\t' in line:
-                # Tab-separated columns
-                cells = line.split('\t')
-            elif '|' in line:
-                # Pipe-separated columns (strip whitespace from each cell)
-                cells = [c.strip() for c in line.split('|')]
-            else:
-                # Single cell row (no separator found)
-                cells = [line]
-            rows.append(cells)
+    # Render pre-split cells when the layout is static, else the whole template
+    rows = None
+    layout = _compile_letterhead(template_text)
+    if layout is not None:
+        rows = _render_letterhead_layout(layout, context)
+    if rows is None:
+        rows = _split_rendered_rows(_render_template(template_text, context, bytecode_cache))
     
     # Add "Printed by" row if enabled (shows who exported and when)
     if settings.get("add_printed_by", True):
-        printed_by_row = [
-            f"Printed by: {context.get('user_fullname', frappe.session.user)}",
-            f"Date: {context.get('date', '')}",
-            f"Time: {context.get('time', '')}"
-        ]
-        rows.append(printed_by_row)
+        # Stringify each component once, so the row holds plain strings
+        user_str = str(context.get("user_fullname") or frappe.session.get("user"))
+        date_str = str(context.get("date", ""))
+        time_str = str(context.get("time", ""))
+        rows.append((f"Printed by: {user_str}", f"Date: {date_str}", f"Time: {time_str}"))
     
     # Always add a blank row at the end to visually separate header from data
     if rows:
-        rows.append([""])
+        rows.append(("",))
     
     return rows